@@ -1,50 +1,118 @@
 import argparse
+import math
+import mmap
 import sys
 import logging
 import logging.config
 import gpxpy
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from gpxpy import parse
-from os import path
+from datetime import datetime, timezone
+from pathlib import Path
+from xml.sax.saxutils import escape, quoteattr
+
+try:
+    # libxml2 parses considerably faster than the stdlib expat parser
+    from lxml.etree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+try:
+    # optional: JIT-compile the simplification kernel
+    from numba import njit
+except ImportError:
+    njit = None
 
 nsmap = {}
 ext = ".gpx"
 
+# structure-of-arrays point layout: lat/lon keep full double precision,
+# elevation fits in f4, time is epoch nanoseconds
+point_dtype = np.dtype(
+    [("lat", "f8"), ("lon", "f8"), ("ele", "f4"), ("time", "i8")]
+)
+
+log = logging.getLogger(__name__)
+
+
 # https://fangpenlin.com/posts/2012/08/26/good-logging-practice-in-python/
-logging.basicConfig(level=logging.DEBUG)
-logging.config.dictConfig(
-    {
-        "version": 1,
-        "disable_existing_loggers": False,
-        "formatters": {
-            "standard": {
-                "format": "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
-            }
-        },
-        "handlers": {
-            "console": {
-                "class": "logging.StreamHandler",
-                "stream": "ext://sys.stdout",
+def setup_logging():
+    # configure once; re-imports and worker processes must not rebuild
+    # handlers or reopen the log file
+    if logging.getLogger().handlers:
+        return
+
+    logging.basicConfig(level=logging.DEBUG)
+    logging.config.dictConfig(
+        {
+            "version": 1,
+            "disable_existing_loggers": False,
+            "formatters": {
+                "standard": {
+                    "format": "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+                }
             },
-            "file": {
-                "level": "DEBUG",
-                "class": "logging.FileHandler",
-                "filename": "gpxmerger.log",
-                "formatter": "standard",
+            "handlers": {
+                "console": {
+                    "class": "logging.StreamHandler",
+                    "stream": "ext://sys.stdout",
+                },
+                "file": {
+                    "level": "DEBUG",
+                    "class": "logging.FileHandler",
+                    "filename": "gpxmerger.log",
+                    "formatter": "standard",
+                },
             },
-        },
-        "loggers": {
-            "__main__": {  # name my module
-                "level": "DEBUG",
-                "propagate": True,
-                "handlers": ["file"],
-            }
-        },
-    }
-)
+            "loggers": {
+                "__main__": {  # name my module
+                    "level": "DEBUG",
+                    "propagate": True,
+                    "handlers": ["file"],
+                }
+            },
+        }
+    )
+
+
+def _parse_time(text):
+    if not text:
+        return None
+    try:
+        time = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+    if time.tzinfo is None:
+        # GPX times are UTC; never fall back to the local timezone
+        time = time.replace(tzinfo=timezone.utc)
+
+    return time
+
+
+def _stream_points(gpx_file, ns):
+    for event, elem in iterparse(gpx_file, events=("start-ns", "end")):
+        if event == "start-ns":
+            prefix, uri = elem
+            ns[prefix or "defaultns"] = uri
+
+        elif elem.tag.rpartition("}")[2] == "trkpt":
+            ele = elem.findtext("{*}ele")
+            yield (
+                float(elem.get("lat")),
+                float(elem.get("lon")),
+                float(ele) if ele is not None else None,
+                _parse_time(elem.findtext("{*}time")),
+            )
+            elem.clear()
+
+        elif elem.tag.rpartition("}")[2] == "trkseg":
+            # drop the already-cleared point shells as well
+            elem.clear()
 
 
 def load_gpxs(files: list):
-    logger = logging.getLogger(__name__)
     gpxs = []
 
     for file in files:
@@ -53,49 +121,122 @@ def load_gpxs(files: list):
                 gpx = parse(gpx_file)
                 gpxs.append(gpx)
                 nsmap.update(gpx.nsmap)
-                logger.debug("Loaded {f}".format(f=file))
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("Loaded %s", file)
 
-        except Exception as e:
-            logger.error(f'Could not load {file}: {e}')
+        except (OSError, gpxpy.gpx.GPXException) as e:
+            log.warning('Skipping %s: %s', file, e)
             continue
 
-    logger.debug("Loaded a total of {s} files".format(s=len(gpxs)))
+    log.debug("Loaded a total of %s files", len(gpxs))
     return gpxs
 
 
 def load_tracks(files: list):
-    logger = logging.getLogger(__name__)
     gpxs = load_gpxs(files)
-    tracks = sum((gpx.tracks for gpx in gpxs), [])
-    logger.debug("Loaded a total of {s} tracks".format(s=len(tracks)))
+    # pre-size the result and fill it with memcpy-like slice assignment
+    tracks = [None] * sum(len(gpx.tracks) for gpx in gpxs)
+    i = 0
+
+    for gpx in gpxs:
+        tracks[i:i + len(gpx.tracks)] = gpx.tracks
+        i += len(gpx.tracks)
+
+    log.debug("Loaded a total of %s tracks", len(tracks))
     return tracks
 
 
 def load_segments(files: list):
-    logger = logging.getLogger(__name__)
-    tracks = load_tracks(files)
-    segments = sum((track.segments for track in tracks), [])
-    logger.debug("Loaded a total of {s} segments".format(s=len(segments)))
+    gpxs = load_gpxs(files)
+    # one pass from gpx to segment, pre-sized like load_tracks
+    segments = [None] * sum(
+        len(track.segments) for gpx in gpxs for track in gpx.tracks
+    )
+    i = 0
+
+    for gpx in gpxs:
+        for track in gpx.tracks:
+            segments[i:i + len(track.segments)] = track.segments
+            i += len(track.segments)
+
+    log.debug("Loaded a total of %s segments", len(segments))
     return segments
 
 
+def _load_file_points(file):
+    # worker for load_points: returns one compact structured array per file
+    ns = {}
+    try:
+        with open(file, mode="rb") as gpx_file, mmap.mmap(
+            gpx_file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as buffer:
+            # the parser reads straight from the page cache via the mmap;
+            # each timestamp is computed a single time
+            rows = [
+                (lat, lon, np.nan if ele is None else ele,
+                 int(time.timestamp() * 1e9))
+                for lat, lon, ele, time in _stream_points(buffer, ns)
+                if time is not None
+            ]
+
+        points = np.array(rows, dtype=point_dtype)
+        points = points[np.argsort(points["time"], kind="stable")]
+        return points, ns, None
+
+    # SyntaxError covers the XML parse errors of both iterparse backends;
+    # anything else (KeyboardInterrupt, bugs) should propagate. The error
+    # crosses the process boundary as a string since lxml exceptions
+    # do not pickle.
+    except (OSError, ValueError, SyntaxError) as e:
+        return np.empty(0, dtype=point_dtype), ns, str(e)
+
+
 def load_points(files: list):
-    logger = logging.getLogger(__name__)
-    segments = load_segments(files)
-    points = sum((segment.points for segment in segments), [])
-    points = list(filter(lambda x: x.time is not None, points))
-    points = sorted(points, key=lambda p: p.time)
-    logger.debug("Loaded a total of {s} points".format(s=len(points)))
+    per_file = []
+
+    with ProcessPoolExecutor() as executor:
+        results = executor.map(_load_file_points, files, chunksize=4)
+
+        for file, (file_points, ns, error) in zip(files, results):
+            if error is not None:
+                log.warning('Skipping %s: %s', file, error)
+                continue
+
+            per_file.append(file_points)
+            nsmap.update(ns)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Loaded %s", file)
+
+    points = (
+        np.concatenate(per_file)
+        if per_file
+        else np.empty(0, dtype=point_dtype)
+    )
+    # the per-file runs are already sorted, so the stable sort over the
+    # concatenation is effectively the k-way merge step
+    points = points[np.argsort(points["time"], kind="stable")]
+    log.debug("Loaded a total of %s points", len(points))
     return points
 
 
+def _materialize_points(points):
+    # turn structured-array rows back into gpxpy objects for serialization
+    for lat, lon, ele, time in points:
+        ele = float(ele)
+        yield gpxpy.gpx.GPXTrackPoint(
+            float(lat),
+            float(lon),
+            elevation=None if math.isnan(ele) else ele,
+            time=datetime.fromtimestamp(time / 1e9, tz=timezone.utc),
+        )
+
+
 def get_gpx(data, name=""):
-    logger = logging.getLogger(__name__)
     gpx = gpxpy.gpx.GPX()
     gpx.nsmap.update(nsmap)
 
     if isinstance(data[0], gpxpy.gpx.GPXTrack):
-        logger.debug("Generating GPX with {s} tracks".format(s=len(data)))
+        log.debug("Generating GPX with %s tracks", len(data))
         gpx.tracks.extend(data)
 
     else:
@@ -104,74 +245,239 @@ def get_gpx(data, name=""):
         gpx.tracks.append(gpx_track)
 
         if isinstance(data[0], gpxpy.gpx.GPXTrackSegment):
-            logger.debug(
-                "Generating GPX with {s} segments".format(s=len(data))
-            )
+            log.debug("Generating GPX with %s segments", len(data))
             gpx_track.segments.extend(data)
 
-        elif isinstance(data[0], gpxpy.gpx.GPXTrackPoint):
+        else:
             # Create first segment in our GPX track:
             gpx_segment = gpxpy.gpx.GPXTrackSegment()
             gpx_track.segments.append(gpx_segment)
 
-            logger.debug("Generating GPX with {s} points".format(s=len(data)))
+            log.debug("Generating GPX with %s points", len(data))
 
-            # Add points:
-            gpx_segment.points.extend(data)
+            # Add points, materializing GPXTrackPoint objects only here:
+            gpx_segment.points.extend(_materialize_points(data))
 
     return gpx
 
 
 def simplify(gpx, distance=None):
     if distance != False:
-        logger = logging.getLogger(__name__)
-        logger.debug(
-            "Simplifying points with maximum distance: {s}".format(
-                s=distance or "default"
-            )
+        log.debug(
+            "Simplifying points with maximum distance: %s",
+            distance or "default",
         )
 
+        # argparse delivers the distance as a string
+        max_distance = float(distance) if distance else None
+
         for track in gpx.tracks:
             for segment in track.segments:
-                segment.simplify(distance)
+                segment.simplify(max_distance)
+
+
+def _rdp_mask(x, y, epsilon):
+    # iterative Ramer-Douglas-Peucker, distances vectorized per split
+    keep = np.zeros(len(x), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(x) - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        xs = x[first + 1:last]
+        ys = y[first + 1:last]
+        norm = math.hypot(dx, dy)
+
+        if norm == 0.0:
+            dists = np.hypot(xs - x[first], ys - y[first])
+        else:
+            # perpendicular distance to the chord via the 2D cross product
+            dists = np.abs((xs - x[first]) * dy - (ys - y[first]) * dx)
+            dists /= norm
+
+        index = int(np.argmax(dists))
+        if dists[index] > epsilon:
+            split = first + 1 + index
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+
+    return keep
+
+
+if njit is not None:
+
+    @njit(cache=True)
+    def _rdp_mask_jit(x, y, epsilon):
+        # same algorithm as _rdp_mask, written with explicit loops and a
+        # flat index stack so numba can compile it to native code
+        n = x.shape[0]
+        keep = np.zeros(n, dtype=np.bool_)
+        keep[0] = True
+        keep[n - 1] = True
+        stack = np.empty((n + 2, 2), dtype=np.int64)
+        stack[0, 0] = 0
+        stack[0, 1] = n - 1
+        sp = 1
+
+        while sp > 0:
+            sp -= 1
+            first = stack[sp, 0]
+            last = stack[sp, 1]
+            if last - first < 2:
+                continue
+
+            dx = x[last] - x[first]
+            dy = y[last] - y[first]
+            norm = math.hypot(dx, dy)
+            max_dist = -1.0
+            index = first
+
+            for i in range(first + 1, last):
+                if norm == 0.0:
+                    dist = math.hypot(x[i] - x[first], y[i] - y[first])
+                else:
+                    dist = abs(
+                        (x[i] - x[first]) * dy - (y[i] - y[first]) * dx
+                    ) / norm
+
+                if dist > max_dist:
+                    max_dist = dist
+                    index = i
+
+            if max_dist > epsilon:
+                keep[index] = True
+                stack[sp, 0] = first
+                stack[sp, 1] = index
+                sp += 1
+                stack[sp, 0] = index
+                stack[sp, 1] = last
+                sp += 1
+
+        return keep
+
+else:
+    _rdp_mask_jit = None
+
+
+def simplify_points(points, distance=None):
+    if distance == False or len(points) < 3:
+        return points
+
+    epsilon = float(distance) if distance else 10.0
+    log.debug("Simplifying points with maximum distance: %s", epsilon)
+
+    # local equirectangular projection to metres; plenty accurate for
+    # the distances RDP compares against
+    y = points["lat"] * 111320.0
+    x = points["lon"] * 111320.0 * math.cos(math.radians(points["lat"].mean()))
+    mask = _rdp_mask_jit if _rdp_mask_jit is not None else _rdp_mask
+    keep = mask(x, y, epsilon)
+    log.debug("Simplified %s points down to %s", len(points), keep.sum())
+    return points[keep]
+
+
+def _gpx_open_tag(gpx):
+    ns = dict(gpx.nsmap)
+    ns.setdefault("defaultns", "http://www.topografix.com/GPX/1/1")
+    attrs = ['version="1.1"', 'creator="gpxmerger"']
+    for prefix, uri in ns.items():
+        name = "xmlns" if prefix == "defaultns" else "xmlns:" + prefix
+        attrs.append("{n}={u}".format(n=name, u=quoteattr(uri)))
+    return "<gpx {a}>".format(a=" ".join(attrs))
+
+
+def _point_xml(point):
+    parts = [
+        '<trkpt lat="{lat}" lon="{lon}">'.format(
+            lat=point.latitude, lon=point.longitude
+        )
+    ]
+
+    if point.elevation is not None:
+        # %g keeps float32 elevations from printing excess digits
+        parts.append("<ele>{e:g}</ele>".format(e=point.elevation))
+
+    if point.time is not None:
+        time = point.time
+        if time.tzinfo is not None:
+            time = time.astimezone(timezone.utc)
+        parts.append(time.strftime("<time>%Y-%m-%dT%H:%M:%SZ</time>"))
+
+    parts.append("</trkpt>")
+    return "".join(parts)
 
 
-def save(gpx, target_file):
-    with open(target_file, "w") as fp:
-        logger = logging.getLogger(__name__)
-        logger.debug("Saving {f}".format(f=target_file))
-        fp.write(gpx.to_xml())
-        logger.debug("Done saving")
+def save(gpx, target_file, stream=False):
+    log.debug("Saving %s", target_file)
+
+    if not stream:
+        # the gpxpy object model may carry extensions and track metadata
+        # the streaming writer knows nothing about; let to_xml keep them
+        with open(target_file, "w") as fp:
+            fp.write(gpx.to_xml())
+
+        log.debug("Done saving")
+        return
+
+    # stream the XML instead of materializing it as one big string
+    with open(target_file, "wb", buffering=1 << 20) as fp:
+        fp.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        fp.write(_gpx_open_tag(gpx).encode("utf-8"))
+
+        for track in gpx.tracks:
+            fp.write(b"<trk>")
+            if track.name:
+                name = escape(track.name)
+                fp.write("<name>{n}</name>".format(n=name).encode("utf-8"))
+
+            for segment in track.segments:
+                fp.write(b"<trkseg>")
+                for point in segment.points:
+                    fp.write(_point_xml(point).encode("utf-8"))
+                fp.write(b"</trkseg>")
+
+            fp.write(b"</trk>")
+
+        fp.write(b"</gpx>")
+
+    log.debug("Done saving")
 
 
 def get_target(files, target=None):
-    logger = logging.getLogger(__name__)
 
-    if not target or not path.isfile(target):
+    # build the Path once instead of re-stat'ing strings per check
+    target = Path(target) if target else None
+
+    if target is None or not target.is_file():
         filename = "merged"
-        dirname = path.dirname(files[0])
+        dirname = Path(files[0]).parent
 
-        if target and path.isdir(target):
+        if target and target.is_dir():
             dirname = target
 
         elif target:
             filename = target
 
-        target = path.join(dirname, filename)
+        target = dirname / filename
 
-    if not target.endswith(ext):
-        target += ext
+    if target.suffix != ext:
+        target = target.with_name(target.name + ext)
 
-    logger.debug("Write result to: {f}".format(f=target))
+    log.debug("Write result to: %s", target)
     return target
 
 
 def get_name(target):
-    return path.splitext(path.basename(target))[0]
+    return Path(target).stem
 
 def merge(files: list, target=None, segment=False, track=False, distance=False):
-    logger = logging.getLogger(__name__)
-    logger.info(f'Start new merge process for {len(files)} files')
+    log.info('Start new merge process for %s files', len(files))
 
     if segment:
         data = load_segments(files)
@@ -184,13 +490,23 @@ def merge(files: list, target=None, segment=False, track=False, distance=False):
 
     target_file = get_target(files, target)
     name = get_name(target_file)
-    gpx = get_gpx(data, name)
-    simplify(gpx, distance)
-    save(gpx, target_file)
-    logger.info("Finish")
+
+    if isinstance(data, np.ndarray):
+        # simplify on the raw arrays, before any objects are built; the
+        # points built from them carry nothing the streaming writer drops
+        data = simplify_points(data, distance)
+        gpx = get_gpx(data, name)
+        save(gpx, target_file, stream=True)
+
+    else:
+        gpx = get_gpx(data, name)
+        simplify(gpx, distance)
+        save(gpx, target_file)
+    log.info("Finish")
 
 
 def main():
+    setup_logging()
     parser = argparse.ArgumentParser(
         description="A simple script to merge multiple GPX files into one large GPX file."
     )
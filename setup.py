@@ -6,5 +6,6 @@ setup(
    description='merges gpx tracks',
    author='Franz',
    author_email='code@locked.de',
-   install_requires=['gpxpy']
+   install_requires=['gpxpy', 'numpy'],
+   extras_require={'fast': ['lxml', 'numba']}
 )